@@ -10,16 +10,27 @@ import asyncio
 import datetime
 import json
 import logging
+import os
 import sys
 import traceback
-from collections import Counter, deque
-from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple, Union
+from collections import defaultdict, deque
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    DefaultDict,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import aiohttp
 import discord
 import mystbin
 import nhentaio
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 import config
 from utils.config import Config
@@ -69,15 +80,22 @@ EXTENSIONS = (
 )
 
 
-def _prefix_callable(bot: Akane, msg: discord.Message) -> Iterable[str]:
+def _prefix_callable(bot: Akane, msg: discord.Message) -> Tuple[str, ...]:
+    guild_id = msg.guild.id if msg.guild is not None else None
+    cached = bot._prefix_cache.get(guild_id)
+    if cached is not None:
+        return cached
+
     user_id = bot.user.id
     base = [f"<@!{user_id}> ", f"<@{user_id}> "]
-    if msg.guild is None:
+    if guild_id is None:
         base.append("a!")
         base.append("A!")
     else:
-        base.extend(bot.prefixes.get(msg.guild.id, ["a!", "A!"]))
-    return base
+        base.extend(bot.prefixes.get(guild_id, ["a!", "A!"]))
+    # immutable, so the same cached object can be handed out to every caller
+    prefixes = bot._prefix_cache[guild_id] = tuple(base)
+    return prefixes
 
 
 class Akane(commands.Bot):
@@ -101,6 +119,12 @@ class Akane(commands.Bot):
         self._prev_events = deque(maxlen=10)
         self.prefixes = Config("prefixes.json")
         self.blacklist = Config("blacklist.json")
+        self._blacklist_set: FrozenSet[int] = frozenset()
+        self._refresh_blacklist()
+        # qualified names that the Config cog may toggle, built lazily
+        self.valid_command_names: Optional[FrozenSet[str]] = None
+        # guild_id -> full prefix list (mentions included), None for DMs
+        self._prefix_cache: Dict[Optional[int], Tuple[str, ...]] = {}
 
         self.emoji = {
             True: "<:TickYes:735498312861351937>",
@@ -121,7 +145,17 @@ class Akane(commands.Bot):
 
         # A counter to auto-ban frequent spammers
         # Triggering the rate limit 5 times in a row will auto-ban the user from the bot.
-        self._auto_spam_count = Counter()
+        self._auto_spam_count: Dict[int, int] = {}
+        self._prune_spam_count.start()
+
+        # Set by cogs once they are usable, for anything that depends on them
+        self.cog_ready: DefaultDict[str, asyncio.Event] = defaultdict(asyncio.Event)
+
+        # Spam warnings and auto-block reports are handled off the message path
+        self._spam_log_queue: asyncio.Queue[
+            Tuple[Context, discord.Message, float, bool]
+        ] = asyncio.Queue(maxsize=1024)
+        self._spam_log_task = self.loop.create_task(self._drain_spam_log())
 
         for extension in EXTENSIONS:
             try:
@@ -130,6 +164,23 @@ class Akane(commands.Bot):
                 print(f"Failed to load extension {extension}.", file=sys.stderr)
                 traceback.print_exc()
 
+    @tasks.loop(minutes=15)
+    async def _prune_spam_count(self) -> None:
+        # one-off offenders would otherwise stay in here forever
+        self._auto_spam_count = {
+            user_id: count
+            for user_id, count in self._auto_spam_count.items()
+            if count >= 2
+        }
+
+    def add_cog(self, cog: commands.Cog) -> None:
+        super().add_cog(cog)
+        self.valid_command_names = None
+
+    def remove_cog(self, name: str) -> None:
+        super().remove_cog(name)
+        self.valid_command_names = None
+
     async def on_socket_response(self, msg: Any) -> None:
         """Websocket responses."""
         self._prev_events.append(msg)
@@ -157,7 +208,7 @@ class Akane(commands.Bot):
         """Get prefixes per guild."""
         proxy_msg = discord.Object(id=0)
         proxy_msg.guild = guild
-        return local_inject(self, proxy_msg)
+        return list(local_inject(self, proxy_msg))
 
     def get_raw_guild_prefixes(self, guild_id: int) -> List[str]:
         """The raw prefixes."""
@@ -172,11 +223,20 @@ class Akane(commands.Bot):
         elif len(prefixes) > 10:
             raise RuntimeError("Cannot have more than 10 custom prefixes.")
         else:
-            await self.prefixes.put(guild.id, sorted(set(prefixes), reverse=True))
+            # longest first, so a prefix like "!" can't shadow "!!"
+            ordered = list(dict.fromkeys(prefixes))
+            ordered.sort(key=lambda p: (-len(p), p))
+            await self.prefixes.put(guild.id, ordered)
+        self._prefix_cache.pop(guild.id, None)
+
+    def _refresh_blacklist(self) -> None:
+        # Config stores its keys as JSON strings, keep an int set for fast lookups
+        self._blacklist_set = frozenset(int(key) for key in self.blacklist.all())
 
     async def add_to_blacklist(self, object_id: int) -> None:
         """Add object to blacklist."""
         await self.blacklist.put(object_id, True)
+        self._refresh_blacklist()
 
     async def remove_from_blacklist(self, object_id: int) -> None:
         """Remove object from blacklist."""
@@ -184,12 +244,17 @@ class Akane(commands.Bot):
             await self.blacklist.remove(object_id)
         except KeyError:
             pass
+        else:
+            self._refresh_blacklist()
 
     async def on_ready(self) -> None:
         """When the websocket reports ready."""
         if not hasattr(self, "uptime"):
             self.uptime = datetime.datetime.utcnow()
 
+        # mention prefixes depend on our user ID, so rebuild them now it's known
+        self._prefix_cache.clear()
+
         print(f"Ready: {self.user} (ID: {self.user.id})")
 
     async def on_resumed(self) -> None:
@@ -211,34 +276,72 @@ class Akane(commands.Bot):
         retry_after: float,
         *,
         autoblock: bool = False,
-    ) -> Optional[discord.WebhookMessage]:
+    ) -> None:
         """Deals with events that spam the log."""
-        guild_name = getattr(ctx.guild, "name", "No Guild (DMs)")
-        guild_id = getattr(ctx.guild, "id", None)
+        try:
+            self._spam_log_queue.put_nowait((ctx, message, retry_after, autoblock))
+        except asyncio.QueueFull:
+            # we're already way behind, dropping a warning is fine
+            pass
+
+    async def _drain_spam_log(self) -> None:
+        """Log queued spam events and report auto-blocks in batches."""
+        while True:
+            batch = [await self._spam_log_queue.get()]
+            # an embed fits 25 fields, so cap a batch at 25 auto-blocks
+            while len(batch) < 25:
+                try:
+                    entry = await asyncio.wait_for(
+                        self._spam_log_queue.get(), timeout=1.0
+                    )
+                except asyncio.TimeoutError:
+                    break
+                batch.append(entry)
+
+            try:
+                await self._log_spam_batch(batch)
+            except Exception:
+                LOGGER.exception("Failed to log a batch of spammers.")
+
+    async def _log_spam_batch(
+        self, batch: List[Tuple[Context, discord.Message, float, bool]]
+    ) -> None:
+        embed = None
         fmt = "User %s (ID %s) in guild %r (ID %s) spamming, retry_after: %.2fs"
-        LOGGER.warning(
-            fmt, message.author, message.author.id, guild_name, guild_id, retry_after
-        )
-        if not autoblock:
+        for ctx, message, retry_after, autoblock in batch:
+            guild = ctx.guild
+            guild_name, guild_id = (
+                (guild.name, guild.id) if guild else ("No Guild (DMs)", None)
+            )
+            LOGGER.warning(
+                fmt,
+                message.author,
+                message.author.id,
+                guild_name,
+                guild_id,
+                retry_after,
+            )
+            if not autoblock:
+                continue
+
+            if embed is None:
+                embed = discord.Embed(title="Auto-blocked Member", colour=0xDDA453)
+            embed.add_field(
+                name=f"{message.author} (ID: {message.author.id})",
+                value=(
+                    f"Guild: {guild_name} (ID: {guild_id})\n"
+                    f"Channel: {message.channel} (ID: {message.channel.id})"
+                ),
+                inline=False,
+            )
+
+        if embed is None:
             return
 
-        webhook = self.stat_webhook
-        embed = discord.Embed(title="Auto-blocked Member", colour=0xDDA453)
-        embed.add_field(
-            name="Member",
-            value=f"{message.author} (ID: {message.author.id})",
-            inline=False,
-        )
-        embed.add_field(
-            name="Guild Info", value=f"{guild_name} (ID: {guild_id})", inline=False
-        )
-        embed.add_field(
-            name="Channel Info",
-            value=f"{message.channel} (ID: {message.channel.id})",
-            inline=False,
-        )
+        if len(embed.fields) > 1:
+            embed.title = "Auto-blocked Members"
         embed.timestamp = datetime.datetime.utcnow()
-        return webhook.send(embed=embed)
+        await self.stat_webhook.send(embed=embed)
 
     async def process_commands(self, message: discord.Message) -> None:
         """Bot's process command override."""
@@ -247,22 +350,25 @@ class Akane(commands.Bot):
         if ctx.command is None:
             return
 
-        if ctx.author.id in self.blacklist:
+        if ctx.author.id in self._blacklist_set:
             return
 
-        if ctx.guild is not None and ctx.guild.id in self.blacklist:
+        if ctx.guild is not None and ctx.guild.id in self._blacklist_set:
             return
 
         bucket = self.spam_control.get_bucket(message)
-        current = message.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+        # derive the POSIX timestamp straight from the snowflake
+        current = ((message.id >> 22) + discord.utils.DISCORD_EPOCH) / 1000
         retry_after = bucket.update_rate_limit(current)
         author_id = message.author.id
         if retry_after and author_id != self.owner_id:
-            self._auto_spam_count[author_id] += 1
+            self._auto_spam_count[author_id] = (
+                self._auto_spam_count.get(author_id, 0) + 1
+            )
             if self._auto_spam_count[author_id] >= 5:
                 await self.add_to_blacklist(author_id)
                 del self._auto_spam_count[author_id]
-                await self.log_spammer(ctx, message, retry_after, autoblock=True)
+                self.log_spammer(ctx, message, retry_after, autoblock=True)
             else:
                 self.log_spammer(ctx, message, retry_after)
             return
@@ -279,6 +385,9 @@ class Akane(commands.Bot):
         """Fires when a message is received."""
         if message.author.bot:
             return
+        # cheap bail-out before building a full Context for regular chatter
+        if not message.content.startswith(_prefix_callable(self, message)):
+            return
         await self.process_commands(message)
 
     async def on_message_edit(
@@ -291,11 +400,13 @@ class Akane(commands.Bot):
 
     async def on_guild_join(self, guild: discord.Guild) -> None:
         """When the bot joins a guild."""
-        if guild.id in self.blacklist:
+        if guild.id in self._blacklist_set:
             await guild.leave()
 
     async def close(self) -> None:
         """When the bot closes."""
+        self._prune_spam_count.cancel()
+        self._spam_log_task.cancel()
         await asyncio.gather(
             super().close(),
             self.session.close(),
@@ -308,14 +419,24 @@ class Akane(commands.Bot):
         try:
             super().run(config.token, reconnect=True)
         finally:
-            with open("prev_events.log", "w", encoding="utf-8") as file_path:
-                for data in self._prev_events:
-                    try:
-                        last_log = json.dumps(data, ensure_ascii=True, indent=4)
-                    except Exception:
-                        file_path.write(f"{data}\n")
-                    else:
-                        file_path.write(f"{last_log}\n")
+            with open(
+                "prev_events.log.tmp", "w", encoding="utf-8", buffering=8192
+            ) as file_path:
+                events = list(self._prev_events)
+                try:
+                    dumped = json.dumps(events, ensure_ascii=True)
+                except Exception:
+                    # something in there isn't serialisable, go one by one
+                    for data in events:
+                        try:
+                            last_log = json.dumps(data, ensure_ascii=True)
+                        except Exception:
+                            file_path.write(f"{data}\n")
+                        else:
+                            file_path.write(f"{last_log}\n")
+                else:
+                    file_path.write(f"{dumped}\n")
+            os.replace("prev_events.log.tmp", "prev_events.log")
 
     @property
     def config(self):
@@ -202,7 +202,8 @@ class Admin(commands.Cog):
         headers = list(results[0].keys())
         table = formats.TabularData()
         table.set_columns(headers)
-        table.add_rows(list(r.values()) for r in results)
+        # records iterate over their values, no need to copy them out
+        table.add_rows(results)
         render = table.render()
 
         fmt = (
@@ -229,7 +230,7 @@ class Admin(commands.Cog):
         headers = list(results[0].keys())
         table = formats.TabularData()
         table.set_columns(headers)
-        table.add_rows(list(r.values()) for r in results)
+        table.add_rows(results)
         render = table.render()
 
         fmt = f"```\n{render}\n```"
@@ -292,15 +293,19 @@ class Admin(commands.Cog):
 
     async def ban_all(self, dick_id: int) -> None:
         """Ban em from all your guilds."""
-        for gid in self.my_guilds:
-            g = self.bot.get_guild(gid)
-            await g.ban(discord.Object(id=dick_id))
+        target = discord.Object(id=dick_id)
+        await asyncio.gather(
+            *(self.bot.get_guild(gid).ban(target) for gid in self.my_guilds),
+            return_exceptions=True,
+        )
 
     async def unban_all(self, not_dick_id: int) -> None:
         """Unban em from all your guilds."""
-        for gid in self.my_guilds:
-            g = self.bot.get_guild(gid)
-            await g.unban(discord.Object(id=not_dick_id))
+        target = discord.Object(id=not_dick_id)
+        await asyncio.gather(
+            *(self.bot.get_guild(gid).unban(target) for gid in self.my_guilds),
+            return_exceptions=True,
+        )
 
     @commands.group(name="ublock", invoke_without_command=True)
     async def _block(self, ctx: Context, user_id: int, *, reason: str) -> None:
@@ -6,8 +6,9 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from __future__ import annotations
 
-import asyncio
 import datetime
+import io
+import time
 import timeit
 import traceback
 from functools import partial
@@ -40,6 +41,16 @@ class AkaneCore(commands.Cog, name="Akane"):
             False: ProfileState("static/Dusk.png", "Akane Dusk"),
             True: ProfileState("static/Dawn.png", "Akane Dawn"),
         }
+        self._avatar_bytes = {}
+        for light, profile in self.akane_details.items():
+            with open(profile.path, "rb") as buffer:
+                self._avatar_bytes[light] = buffer.read()
+        self._timeit_base = {
+            **globals(),
+            "discord": discord,
+            "commands": commands,
+            "bot": bot,
+        }
         self.akane_time = datetime.datetime.utcnow()
         self.akane_next: Optional[datetime.datetime] = None
 
@@ -49,14 +60,12 @@ class AkaneCore(commands.Cog, name="Akane"):
     @commands.command(name="hello")
     async def hello(self, ctx: Context) -> None:
         """Say hello to Akane."""
-        now = datetime.datetime.utcnow()
-        time = now.hour >= 6 and now.hour < 18
-        path = self.akane_details[time].path
-
-        file = discord.File(path, filename="akane.jpg")
+        hour = (int(time.time()) // 3600) % 24
+        light = 6 <= hour < 18
+        file = discord.File(io.BytesIO(self._avatar_bytes[light]), filename="akane.jpg")
         embed = discord.Embed(colour=self.bot.colour["dsc"])
         embed.set_image(url="attachment://akane.jpg")
-        embed.description = f"Hello, I am {self.akane_details[time].name}, written by Umbra#0009.\n\nYou should see my other side~"
+        embed.description = f"Hello, I am {self.akane_details[light].name}, written by Umbra#0009.\n\nYou should see my other side~"
 
         await ctx.send(embed=embed, file=file)
 
@@ -91,17 +100,14 @@ class AkaneCore(commands.Cog, name="Akane"):
     ) -> None:
 
         await ctx.message.add_reaction(self.bot.emoji[None])
-        timeit_globals = {
-            "ctx": ctx,
-            "guild": ctx.guild,
-            "author": ctx.author,
-            "bot": ctx.bot,
-            "channel": ctx.channel,
-            "message": ctx.message,
-            "discord": discord,
-            "commands": commands,
-        }
-        timeit_globals.update(globals())
+        timeit_globals = self._timeit_base.copy()
+        timeit_globals.update(
+            ctx=ctx,
+            guild=ctx.guild,
+            author=ctx.author,
+            channel=ctx.channel,
+            message=ctx.message,
+        )
 
         func = partial(
             timeit.timeit, body.content, number=iterations, globals=timeit_globals
@@ -143,7 +149,7 @@ class AkaneCore(commands.Cog, name="Akane"):
 
     def dt(self) -> Tuple[bool, datetime.datetime]:
         now = datetime.datetime.utcnow()
-        light = now.hour >= 6 and now.hour < 18
+        light = 6 <= now.hour < 18
         start = datetime.time(hour=(18 if light else 6))
 
         if now.time() > start:
@@ -156,17 +162,14 @@ class AkaneCore(commands.Cog, name="Akane"):
     async def akane_task(self) -> None:
         light, then = self.dt()
 
-        profile = self.akane_details[light]
-        name = profile.name
-        path = profile.path
+        name = self.akane_details[light].name
 
         if now := (datetime.datetime.utcnow()) > self.akane_time:
             await self.webhook_send(
                 f"In task: Now {now}, mapped time: {self.akane_time}"
             )
-            with open(path, "rb") as buffer:
-                await self.webhook_send(f"Performing change to: {name}")
-                await self.bot.user.edit(username=name, avatar=buffer.read())
+            await self.webhook_send(f"Performing change to: {name}")
+            await self.bot.user.edit(username=name, avatar=self._avatar_bytes[light])
 
         self.akane_time = then
 
@@ -176,17 +179,14 @@ class AkaneCore(commands.Cog, name="Akane"):
 
         light, then = self.dt()
 
-        profile = self.akane_details[light]
-        name = profile.name
-        path = profile.path
+        name = self.akane_details[light].name
         await self.webhook_send(name)
 
         if (light and self.bot.user.name != "Akane Dawn") or (
             not light and self.bot.user.name != "Akane Dusk"
         ):
-            with open(path, "rb") as buffer:
-                await self.webhook_send(f"Drift - changing to: {name}.")
-                await self.bot.user.edit(username=name, avatar=buffer.read())
+            await self.webhook_send(f"Drift - changing to: {name}.")
+            await self.bot.user.edit(username=name, avatar=self._avatar_bytes[light])
 
         self.akane_time = then
         await self.webhook_send(f"Before task: waiting until {then}.")
@@ -211,10 +211,8 @@ class AkaneCore(commands.Cog, name="Akane"):
     async def webhook_send(
         self, message: str = "Error", *, embed: discord.Embed = None
     ):
+        await self.bot.cog_ready["Stats"].wait()
         cog = self.bot.get_cog("Stats")
-        if not cog:
-            await asyncio.sleep(5)
-            return await self.webhook_send(message, embed=embed)
         wh = cog.webhook
         await wh.send(message, embed=embed)
 
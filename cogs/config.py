@@ -6,9 +6,18 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from __future__ import annotations
 
-from collections import defaultdict
-from itertools import accumulate
-from typing import TYPE_CHECKING, Iterable, List, Optional, Set, Union
+import re
+from itertools import groupby
+from operator import itemgetter
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Union,
+)
 
 import asyncpg
 import discord
@@ -34,10 +43,10 @@ class LazyEntity:
     def __init__(self, guild: discord.Guild, entity_id: int) -> None:
         self.entity_id = entity_id
         self.guild = guild
-        self._cache = None
+        self._cache: Optional[str] = None
 
     def __str__(self) -> str:
-        if self._cache:
+        if self._cache is not None:
             return self._cache
 
         entity = self.entity_id
@@ -50,6 +59,32 @@ class LazyEntity:
         return self._cache
 
 
+# administrator | manage_guild
+_MANAGE_GUILD_BITS = 0x8 | 0x20
+
+
+def _has_manage_guild(member: discord.Member) -> bool:
+    """Same as ``member.guild_permissions.manage_guild``, without building
+    the sorted ``member.roles`` list or a Permissions object.
+    """
+    guild = member.guild
+    if guild.owner_id == member.id:
+        return True
+
+    # _roles holds bare ids without @everyone, so nothing is resolved past the
+    # first role granting it
+    get_role = guild.get_role
+    for role_id in (guild.id, *member._roles):
+        role = get_role(role_id)
+        if role is not None and role._permissions & _MANAGE_GUILD_BITS:
+            return True
+    return False
+
+
+_TEXT_CHANNEL_CONVERTER = commands.TextChannelConverter()
+_MEMBER_CONVERTER = commands.MemberConverter()
+
+
 class ChannelOrMember(commands.Converter):
     """ Channel or member converter. """
 
@@ -57,10 +92,21 @@ class ChannelOrMember(commands.Converter):
         self, ctx: Context, argument: str
     ) -> Union[discord.TextChannel, discord.Member]:
         """ perform conversion. """
+        # skip the exception round-trip when the argument's shape tells us
+        if argument.startswith("<#"):
+            return await _TEXT_CHANNEL_CONVERTER.convert(ctx, argument)
+        if argument.startswith("<@"):
+            return await _MEMBER_CONVERTER.convert(ctx, argument)
+        if re.fullmatch(r"[0-9]{15,20}", argument):
+            if isinstance(ctx.guild.get_channel(int(argument)), discord.TextChannel):
+                return await _TEXT_CHANNEL_CONVERTER.convert(ctx, argument)
+            return await _MEMBER_CONVERTER.convert(ctx, argument)
+
+        # a bare name (or a short all-digit name) could be either
         try:
-            return await commands.TextChannelConverter().convert(ctx, argument)
+            return await _TEXT_CHANNEL_CONVERTER.convert(ctx, argument)
         except commands.BadArgument:
-            return await commands.MemberConverter().convert(ctx, argument)
+            return await _MEMBER_CONVERTER.convert(ctx, argument)
 
 
 class Plonks(db.Table):
@@ -99,11 +145,13 @@ class CommandName(commands.Converter):
         """ Perform conversion. """
         lowered = argument.lower()
 
-        valid_commands = {
-            c.qualified_name
-            for c in ctx.bot.walk_commands()
-            if c.cog_name not in ("Config", "Admin")
-        }
+        valid_commands = ctx.bot.valid_command_names
+        if valid_commands is None:
+            valid_commands = ctx.bot.valid_command_names = frozenset(
+                c.qualified_name
+                for c in ctx.bot.walk_commands()
+                if c.cog_name not in ("Config", "Admin")
+            )
 
         if lowered not in valid_commands:
             raise commands.BadArgument(f"Command {lowered!r} is not valid.")
@@ -119,50 +167,97 @@ class ResolvedCommandPermissions:
 
         __slots__ = ("allow", "deny")
 
+        def __init__(
+            self,
+            allow: FrozenSet[str] = frozenset(),
+            deny: FrozenSet[str] = frozenset(),
+        ) -> None:
+            self.allow = allow
+            self.deny = deny
+
+    class _Node:
+        """ A node of the per-channel command trie. """
+
+        __slots__ = ("allow", "deny", "children")
+
         def __init__(self) -> None:
-            self.allow = set()
-            self.deny = set()
+            self.allow = False
+            self.deny = False
+            self.children: Dict[str, ResolvedCommandPermissions._Node] = {}
 
     def __init__(self, guild_id: int, records: List[asyncpg.Record]) -> None:
         self.guild_id = guild_id
 
-        self._lookup = defaultdict(self._Entry)
+        self._lookup: Dict[Optional[int], ResolvedCommandPermissions._Entry] = {}
 
         # channel_id: { allow: [commands], deny: [commands] }
+        # channel_id: trie of command tokens, "foo bar" -> foo -> bar
+        self._tries: Dict[Optional[int], ResolvedCommandPermissions._Node] = {}
+
+        # records come ordered by (channel_id, whitelist), so each run is one set
+        for (channel_id, whitelist), group in groupby(records, key=itemgetter(1, 2)):
+            names = frozenset(r[0] for r in group)
 
-        for name, channel_id, whitelist in records:
-            entry = self._lookup[channel_id]
+            entry = self._lookup.get(channel_id)
+            if entry is None:
+                entry = self._lookup[channel_id] = self._Entry()
             if whitelist:
-                entry.allow.add(name)
+                entry.allow = entry.allow | names
             else:
-                entry.deny.add(name)
-
-    def _split(self, obj: str) -> List[str]:
-        """ Splits objects into list. """
-        # "hello there world" -> ["hello", "hello there", "hello there world"]
-        return list(accumulate(obj.split(), lambda x, y: f"{x} {y}"))
-
-    def get_blocked_commands(self, channel_id: int) -> Set[str]:
-        """ Gets the blocked command. """
-        if not self._lookup:
-            return set()
-
-        guild = self._lookup[None]
-        channel = self._lookup[channel_id]
+                entry.deny = entry.deny | names
+
+            root = self._tries.get(channel_id)
+            if root is None:
+                root = self._tries[channel_id] = self._Node()
+            for name in names:
+                node = root
+                for token in name.split():
+                    child = node.children.get(token)
+                    if child is None:
+                        child = node.children[token] = self._Node()
+                    node = child
+
+                if whitelist:
+                    node.allow = True
+                else:
+                    node.deny = True
 
         # first, apply the guild-level denies
-        ret = guild.deny - guild.allow
+        guild = self._lookup.get(None, self._Entry())
+        self._blocked_default = guild.deny - guild.allow
 
         # then apply the channel-level denies
-        return ret | (channel.deny - channel.allow)
+        self._blocked_by_channel = {
+            channel_id: self._blocked_default | (entry.deny - entry.allow)
+            for channel_id, entry in self._lookup.items()
+            if channel_id is not None
+        }
 
-    def _is_command_blocked(self, name: str, channel_id: int) -> bool:
-        command_names = self._split(name)
+    @staticmethod
+    def _walk(
+        node: Optional[ResolvedCommandPermissions._Node],
+        tokens: List[str],
+        blocked: Optional[bool],
+    ) -> Optional[bool]:
+        # "foo bar" visits "foo" then "foo bar", the deepest match wins
+        for token in tokens:
+            if node is None:
+                break
+            node = node.children.get(token)
+            if node is None:
+                break
+            if node.deny:
+                blocked = True
+            if node.allow:
+                blocked = False
+        return blocked
 
-        guild = self._lookup[None]  # no special channel_id
-        channel = self._lookup[channel_id]
+    def get_blocked_commands(self, channel_id: int) -> FrozenSet[str]:
+        """ Gets the blocked command. """
+        return self._blocked_by_channel.get(channel_id, self._blocked_default)
 
-        blocked = None
+    def _is_command_blocked(self, name: str, channel_id: int) -> bool:
+        tokens = name.split()
 
         # apply guild-level denies first
         # then guild-level allow
@@ -173,23 +268,10 @@ class ResolvedCommandPermissions:
         # ?foo bar <- guild allow
         # ?foo <- channel block
         # result: blocked
-        # this is why the two for loops are separate
-
-        for command in command_names:
-            if command in guild.deny:
-                blocked = True
-
-            if command in guild.allow:
-                blocked = False
+        # this is why the two walks are separate
 
-        for command in command_names:
-            if command in channel.deny:
-                blocked = True
-
-            if command in channel.allow:
-                blocked = False
-
-        return blocked
+        blocked = self._walk(self._tries.get(None), tokens, None)
+        return self._walk(self._tries.get(channel_id), tokens, blocked)
 
     def is_command_blocked(self, name: str, channel_id: int) -> bool:
         """" Is the command blocked? """
@@ -204,10 +286,14 @@ class ResolvedCommandPermissions:
         if not self._lookup:
             return False
 
-        if (
-            isinstance(ctx.author, discord.Member)
-            and ctx.author.guild_permissions.manage_guild
-        ):
+        manage_guild = ctx._manage_guild
+        if manage_guild is None:
+            manage_guild = ctx._manage_guild = (
+                isinstance(ctx.author, discord.Member)
+                and _has_manage_guild(ctx.author)
+            )
+
+        if manage_guild:
             return False
 
         return self._is_command_blocked(ctx.command.qualified_name, ctx.channel.id)
@@ -222,8 +308,9 @@ class Config(commands.Cog):
 
     def __init__(self, bot: Akane):
         self.bot = bot
+        # guild_id: every plonked channel or member ID in that guild
+        self._plonk_cache: Dict[int, FrozenSet[int]] = {}
 
-    @cache.cache(strategy=cache.Strategy.lru, maxsize=1024, ignore_kwargs=True)
     async def is_plonked(
         self,
         guild_id: int,
@@ -241,32 +328,30 @@ class Config(commands.Cog):
             guild = self.bot.get_guild(guild_id)
             if guild is not None:
                 member = guild.get_member(member_id)
-                if member is not None and member.guild_permissions.manage_guild:
+                if member is not None and _has_manage_guild(member):
                     return False
 
-        connection = connection or self.bot.pool
-
-        if channel_id is None:
-            query = "SELECT 1 FROM plonks WHERE guild_id=$1 AND entity_id=$2;"
-            row = await connection.fetchrow(query, guild_id, member_id)
-        else:
-            query = "SELECT 1 FROM plonks WHERE guild_id=$1 AND entity_id IN ($2, $3);"
-            row = await connection.fetchrow(query, guild_id, member_id, channel_id)
+        plonks = self._plonk_cache.get(guild_id)
+        if plonks is None:
+            connection = connection or self.bot.pool
+            query = "SELECT entity_id FROM plonks WHERE guild_id=$1;"
+            records = await connection.fetch(query, guild_id)
+            plonks = self._plonk_cache[guild_id] = frozenset(r[0] for r in records)
 
-        return row is not None
+        return member_id in plonks or (channel_id is not None and channel_id in plonks)
 
     async def bot_check_once(self, ctx: Context) -> bool:
         """ Performs a check only once for the cog. """
         if ctx.guild is None:
             return True
 
-        is_owner = await ctx.bot.is_owner(ctx.author)
+        is_owner = ctx._is_owner = await ctx.bot.is_owner(ctx.author)
         if is_owner:
             return True
 
         # see if they can bypass:
         if isinstance(ctx.author, discord.Member):
-            bypass = ctx.author.guild_permissions.manage_guild
+            bypass = ctx._manage_guild = _has_manage_guild(ctx.author)
             if bypass:
                 return True
 
@@ -287,9 +372,11 @@ class Config(commands.Cog):
     ) -> ResolvedCommandPermissions:
         """ Get command permissions. """
         connection = connection or self.bot.pool
-        query = (
-            "SELECT name, channel_id, whitelist FROM command_config WHERE guild_id=$1;"
-        )
+        query = """SELECT name, channel_id, whitelist
+                   FROM command_config
+                   WHERE guild_id=$1
+                   ORDER BY channel_id NULLS FIRST, whitelist;
+                """
 
         records = await connection.fetch(query, guild_id)
         return ResolvedCommandPermissions(guild_id, records)
@@ -298,7 +385,9 @@ class Config(commands.Cog):
         if ctx.guild is None:
             return True
 
-        is_owner = await ctx.bot.is_owner(ctx.author)
+        is_owner = ctx._is_owner
+        if is_owner is None:
+            is_owner = ctx._is_owner = await ctx.bot.is_owner(ctx.author)
         if is_owner:
             return True
 
@@ -310,25 +399,15 @@ class Config(commands.Cog):
         ctx: Context,
         entries: Iterable[Union[discord.TextChannel, discord.Member]],
     ) -> None:
-        async with ctx.acquire():
-            async with ctx.db.transaction():
-                query = "SELECT entity_id FROM plonks WHERE guild_id=$1;"
-                records = await ctx.db.fetch(query, ctx.guild.id)
-
-                # we do not want to insert duplicates
-                current_plonks = {r[0] for r in records}
-                guild_id = ctx.guild.id
-                to_insert = [
-                    (guild_id, e.id) for e in entries if e.id not in current_plonks
-                ]
-
-                # do a bulk COPY
-                await ctx.db.copy_records_to_table(
-                    "plonks", columns=("guild_id", "entity_id"), records=to_insert
-                )
+        # let the server skip anything that is already plonked
+        query = """INSERT INTO plonks (guild_id, entity_id)
+                   SELECT $1, entity_id FROM unnest($2::bigint[]) AS entity_id
+                   ON CONFLICT (entity_id) DO NOTHING;
+                """
+        await ctx.db.execute(query, ctx.guild.id, [e.id for e in entries])
 
-                # invalidate the cache for this guild
-                self.is_plonked.invalidate_containing(f"{ctx.guild.id!r}:")
+        # invalidate the cache for this guild
+        self._plonk_cache.pop(ctx.guild.id, None)
 
     async def cog_command_error(
         self, ctx: Context, error: commands.CommandError
@@ -361,7 +440,7 @@ class Config(commands.Cog):
             await ctx.db.execute(query, ctx.guild.id, ctx.channel.id)
 
             # invalidate the cache for this guild
-            self.is_plonked.invalidate_containing(f"{ctx.guild.id!r}:")
+            self._plonk_cache.pop(ctx.guild.id, None)
         else:
             await self._bulk_ignore_entries(ctx, entities)
 
@@ -417,7 +496,7 @@ class Config(commands.Cog):
 
         query = "DELETE FROM plonks WHERE guild_id=$1;"
         await ctx.db.execute(query, ctx.guild.id)
-        self.is_plonked.invalidate_containing(f"{ctx.guild.id!r}:")
+        self._plonk_cache.pop(ctx.guild.id, None)
         await ctx.send("Successfully cleared all ignores.")
 
     @config.group(pass_context=True, invoke_without_command=True)
@@ -438,7 +517,7 @@ class Config(commands.Cog):
             entities = [c.id for c in entities]
             await ctx.db.execute(query, ctx.guild.id, entities)
 
-        self.is_plonked.invalidate_containing(f"{ctx.guild.id!r}:")
+        self._plonk_cache.pop(ctx.guild.id, None)
         await ctx.send(ctx.tick(True))
 
     @unignore.command(name="all")
@@ -478,17 +557,16 @@ class Config(commands.Cog):
             args = (guild_id, name, channel_id)
 
         async with connection.transaction():
-            # delete the previous entry regardless of what it was
-            query = f"DELETE FROM command_config WHERE guild_id=$1 AND name=$2 AND {subcheck};"
-
-            # DELETE <num>
-            await connection.execute(query, *args)
-
-            query = "INSERT INTO command_config (guild_id, channel_id, name, whitelist) VALUES ($1, $2, $3, $4);"
+            query = """INSERT INTO command_config (guild_id, channel_id, name, whitelist)
+                       VALUES ($1, $2, $3, $4)
+                       ON CONFLICT (channel_id, name, whitelist) DO NOTHING
+                       RETURNING id;
+                    """
+            row = await connection.fetchrow(
+                query, guild_id, channel_id, name, whitelist
+            )
 
-            try:
-                await connection.execute(query, guild_id, channel_id, name, whitelist)
-            except asyncpg.UniqueViolationError:
+            if row is None:
                 msg = (
                     "This command is already disabled."
                     if not whitelist
@@ -496,6 +574,11 @@ class Config(commands.Cog):
                 )
                 raise RuntimeError(msg)
 
+            # now remove whatever entry was there before
+            # NULL channel_ids never conflict, so this also clears server-level dupes
+            query = f"DELETE FROM command_config WHERE guild_id=$1 AND name=$2 AND {subcheck} AND id <> ${len(args) + 1};"
+            await connection.execute(query, *args, row["id"])
+
     @channel.command(name="disable")
     async def channel_disable(self, ctx: Context, *, command: CommandName) -> None:
         """Disables a command for this channel."""
@@ -5,14 +5,16 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 from __future__ import annotations
 
-import json
-import textwrap
+import asyncio
+import logging
 from datetime import datetime
+from pathlib import Path
 from typing import Union, Optional, TYPE_CHECKING
 from utils.context import Context
 
+import asyncpg
 import discord
-from aiohttp import ContentTypeError
+import orjson
 from currency_converter import CurrencyConverter
 from discord.ext import commands
 
@@ -22,16 +24,54 @@ if TYPE_CHECKING:
     from bot import Akane
 
 
+# this never changes, so load it once at import rather than per cog instance
+CURRENCY_SYMBOLS: dict[str, str] = {
+    code["cc"]: code.get("symbol", "")
+    for code in orjson.loads(
+        (Path(__file__).parent.parent / "utils" / "currency_codes.json").read_bytes()
+    )
+}
+
+log = logging.getLogger(__name__)
+
+INVALID_FEED_NAMES = frozenset({"@everyone", "@here", ""})
+
+
 class Feeds(db.Table):
     id = db.PrimaryKeyColumn()
     channel_id = db.Column(db.Integer(big=True))
     role_id = db.Column(db.Integer(big=True))
     name = db.Column(db.String)
 
+    @classmethod
+    def create_table(cls, *, exists_ok=True):
+        statement = super().create_table(exists_ok=exists_ok)
+        # create the unique index
+        sql = "CREATE UNIQUE INDEX IF NOT EXISTS feeds_uniq_idx ON feeds (channel_id, name);"
+        return statement + "\n" + sql
+
 
 class PypiObject:
     """Pypi objects."""
 
+    __slots__ = (
+        "url",
+        "module_name",
+        "module_author",
+        "module_author_email",
+        "module_licese",
+        "module_minimum_py",
+        "module_latest_ver",
+        "release_time",
+        "module_description",
+        "pypi_urls",
+        "raw_classifiers",
+        "description",
+        "classifiers",
+        "release_datetime",
+        "url_field",
+    )
+
     def __init__(self, name: str, pypi_dict: dict[str, Optional[Union[int, str]]]):
         self.url = f"https://pypi.org/project/{name}/"
         self.module_name = pypi_dict["info"]["name"]
@@ -44,36 +84,52 @@ class PypiObject:
             pypi_dict["info"]["requires_python"] or "No minimum version specified."
         )
         self.module_latest_ver = pypi_dict["info"]["version"]
-        self.release_time = pypi_dict["releases"][str(self.module_latest_ver)][0][
-            "upload_time"
-        ]
+        release = pypi_dict["releases"][str(self.module_latest_ver)][0]
+        self.release_time = release["upload_time"]
         self.module_description = pypi_dict["info"]["summary"] or None
         self.pypi_urls = pypi_dict["info"]["project_urls"]
         self.raw_classifiers = pypi_dict["info"]["classifiers"] or None
 
-    @property
-    def urls(self) -> str:
-        return self.pypi_urls or "No URLs listed."
+        # these end up in the embed, and instances are cached, so build them once
+        self.description = self._build_description()
+        self.classifiers = self._build_classifiers()
+        self.url_field = (
+            "\n".join(f"[{key}]({value})" for key, value in self.pypi_urls.items())
+            if self.pypi_urls
+            else "No URLs listed."
+        )
+        # the ISO 8601 variant is UTC-tagged, fromisoformat just can't read the "Z"
+        released_iso = release.get("upload_time_iso_8601")
+        if released_iso:
+            released = datetime.fromisoformat(released_iso.replace("Z", "+00:00"))
+        else:
+            released = datetime.fromisoformat(self.release_time)
+        self.release_datetime = time.hf_time(released)
 
     @property
     def minimum_ver(self) -> str:
         return discord.utils.escape_markdown(self.module_minimum_py)
 
-    @property
-    def classifiers(self) -> str:
+    def _build_classifiers(self) -> Optional[str]:
         if self.raw_classifiers:
-            new = textwrap.shorten("\N{zwsp}".join(self.raw_classifiers), width=300)
-            return "\n".join(new.split("\N{zwsp}"))
-
-    @property
-    def description(self) -> str:
-        if self.module_description:
-            return textwrap.shorten(self.module_description, width=300)
+            # keep whole classifiers until we'd go past 300 characters
+            out, total = [], 0
+            for classifier in self.raw_classifiers:
+                if total + len(classifier) > 300:
+                    out.append("...")
+                    break
+                out.append(classifier)
+                total += len(classifier) + 1
+            return "\n".join(out)
         return None
 
-    @property
-    def release_datetime(self) -> datetime:
-        return time.hf_time(datetime.fromisoformat(self.release_time))
+    def _build_description(self) -> Optional[str]:
+        description = self.module_description
+        if description:
+            if len(description) > 300:
+                return description[:299] + "\N{HORIZONTAL ELLIPSIS}"
+            return description
+        return None
 
 
 class External(commands.Cog):
@@ -83,19 +139,27 @@ class External(commands.Cog):
         self.bot = bot
         self.headers = {"User-Agent": "Akane Discord bot."}
         self.currency_conv = CurrencyConverter()
-        self.currency_codes: dict[str, str] = json.loads(
-            open("utils/currency_codes.json").read()
-        )
+
+    @cache.cache(maxsize=300, strategy=cache.Strategy.timed)
+    async def get_pypi_package(self, package_name: str) -> Optional[PypiObject]:
+        async with self.bot.session.get(
+            f"https://pypi.org/pypi/{package_name}/json", headers=self.headers
+        ) as pypi_resp:
+            if pypi_resp.status == 404:
+                return None
+            # orjson parses the raw UTF-8 bytes directly, skipping the str decode
+            pypi_json = orjson.loads(await pypi_resp.read())
+        return PypiObject(package_name, pypi_json)
 
     @commands.command()
     @commands.cooldown(1, 10, commands.BucketType.user)
     async def pypi(self, ctx: Context, *, package_name: str):
         """Searches PyPi for a Package."""
-        async with self.bot.session.get(
-            f"https://pypi.org/pypi/{package_name}/json", headers=self.headers
-        ) as pypi_resp:
-            pypi_json = await pypi_resp.json()
-        pypi_details = PypiObject(package_name, pypi_json)
+        # PyPI treats these as the same project, so share the cache entry
+        normalised = package_name.lower().replace("_", "-")
+        pypi_details = await self.get_pypi_package(normalised)
+        if pypi_details is None:
+            return await ctx.send("That package doesn't exist on PyPi.")
 
         embed = discord.Embed(
             title=f"{pypi_details.module_name} on PyPi",
@@ -125,16 +189,7 @@ class External(commands.Cog):
             inline=False,
         )
 
-        if isinstance(pypi_details.urls, str):
-            urls = pypi_details.urls
-        elif isinstance(pypi_details.urls, dict):
-            urls = "\n".join(
-                [f"[{key}]({value})" for key, value in pypi_details.urls.items()]
-            )
-        else:
-            urls = "N/A"
-
-        embed.add_field(name="Relevant URLs", value=urls)
+        embed.add_field(name="Relevant URLs", value=pypi_details.url_field)
         embed.add_field(name="License", value=pypi_details.module_licese)
 
         if pypi_details.raw_classifiers:
@@ -153,19 +208,17 @@ class External(commands.Cog):
         source = source.upper()
         dest = dest.upper()
         new_amount = self.currency_conv.convert(amount, source, dest)
-        prefix = next(
-            (curr for curr in self.currency_codes if curr["cc"] == dest), None
-        ).get("symbol")
+        prefix = CURRENCY_SYMBOLS.get(dest, "")
         await ctx.send(f"{prefix}{round(new_amount, 2):.2f}")
 
     @pypi.error
     async def pypi_error(self, ctx: Context, error: commands.CommandError) -> None:
         error = getattr(error, "original", error)
-        if isinstance(error, ContentTypeError):
+        if isinstance(error, orjson.JSONDecodeError):
             error.handled = True
             return await ctx.send("That package doesn't exist on PyPi.")
 
-    @cache.cache()
+    @cache.cache(maxsize=1024, strategy=cache.Strategy.lru)
     async def get_feeds(
         self,
         channel_id: int,
@@ -174,8 +227,8 @@ class External(commands.Cog):
     ) -> dict[str, str]:
         con = connection or self.bot.pool
         query = "SELECT name, role_id FROM feeds WHERE channel_id=$1;"
-        feeds = await con.fetch(query, channel_id)
-        return {f["name"]: f["role_id"] for f in feeds}
+        # records iterate as (name, role_id) pairs
+        return dict(await con.fetch(query, channel_id))
 
     @commands.group(name="feeds", invoke_without_command=True)
     @commands.guild_only()
@@ -206,21 +259,37 @@ class External(commands.Cog):
 
         name = name.lower()
 
-        if name in ("@everyone", "@here"):
+        # role names cap out at 100 characters, and we don't want anything ping-like
+        if len(name) > 100 or "@" in name or name in INVALID_FEED_NAMES:
             return await ctx.send("That is an invalid feed name.")
 
-        query = "SELECT role_id FROM feeds WHERE channel_id=$1 AND name=$2;"
-
-        exists = await ctx.db.fetchrow(query, ctx.channel.id, name)
-        if exists is not None:
+        query = """INSERT INTO feeds (role_id, channel_id, name)
+                   VALUES (0, $1, $2)
+                   ON CONFLICT (channel_id, name) DO NOTHING
+                   RETURNING id;
+                """
+        try:
+            inserted = await ctx.db.fetchrow(query, ctx.channel.id, name)
+        except asyncpg.InvalidColumnReferenceError:
+            # databases from before feeds_uniq_idx existed lack the ON CONFLICT target
+            log.error("feeds_uniq_idx is missing, run `launcher.py db sync external`")
+            await ctx.send("Feeds need a database update, ask the bot owner.")
+            return
+        if inserted is None:
             await ctx.send("This feed already exists.")
             return
 
-        role = await ctx.guild.create_role(
-            name=name, permissions=discord.Permissions.none()
-        )
-        query = "INSERT INTO feeds (role_id, channel_id, name) VALUES ($1, $2, $3);"
-        await ctx.db.execute(query, role.id, ctx.channel.id, name)
+        # the claim is committed first so no transaction is held across the HTTP call
+        try:
+            role = await ctx.guild.create_role(
+                name=name, permissions=discord.Permissions.none()
+            )
+        except Exception:
+            await ctx.db.execute("DELETE FROM feeds WHERE id=$1;", inserted["id"])
+            raise
+        query = "UPDATE feeds SET role_id=$1 WHERE id=$2;"
+        await ctx.db.execute(query, role.id, inserted["id"])
+
         self.get_feeds.invalidate(self, ctx.channel.id)
         await ctx.send(f"{ctx.tick(True)} Successfully created feed.")
 
@@ -234,25 +303,24 @@ class External(commands.Cog):
         """
 
         query = "DELETE FROM feeds WHERE channel_id=$1 AND name=$2 RETURNING *;"
-        records = await ctx.db.fetch(query, ctx.channel.id, feed)
+        records = await ctx.db.fetch(query, ctx.channel.id, feed.lower())
         self.get_feeds.invalidate(self, ctx.channel.id)
 
         if len(records) == 0:
             return await ctx.send("This feed does not exist.")
 
-        for record in records:
-            role = discord.utils.find(
-                lambda r: r.id == record["role_id"], ctx.guild.roles
-            )
-            if role is not None:
-                try:
-                    await role.delete()
-                except discord.HTTPException:
-                    continue
+        roles = [ctx.guild.get_role(record["role_id"]) for record in records]
+        # failed deletions are ignored, same as before
+        await asyncio.gather(
+            *(role.delete() for role in roles if role is not None),
+            return_exceptions=True,
+        )
 
         await ctx.send(f"{ctx.tick(True)} Removed feed.")
 
     async def do_subscription(self, ctx, feed, action):
+        # feed names are stored lowercased
+        feed = feed.lower()
         feeds = await self.get_feeds(ctx.channel.id)
         if len(feeds) == 0:
             await ctx.send("This channel has no feeds set up.")
@@ -265,12 +333,12 @@ class External(commands.Cog):
             return
 
         role_id = feeds[feed]
-        role = discord.utils.find(lambda r: r.id == role_id, ctx.guild.roles)
+        role = ctx.guild.get_role(role_id)
         if role is not None:
             await action(role)
-            await ctx.message.add_reaction(ctx.tick(True).strip("<:>"))
+            await ctx.message.add_reaction(self.bot.emoji[True])
         else:
-            await ctx.message.add_reaction(ctx.tick(False).strip("<:>"))
+            await ctx.message.add_reaction(self.bot.emoji[False])
 
     @commands.command()
     @commands.guild_only()
@@ -306,7 +374,7 @@ class External(commands.Cog):
             await ctx.send("This feed does not exist.")
             return
 
-        role = discord.utils.get(ctx.guild.roles, id=feeds[feed])
+        role = ctx.guild.get_role(feeds[feed])
         if role is None:
             fmt = (
                 "Uh.. a fatal error occurred here. The role associated with "
@@ -322,15 +390,23 @@ class External(commands.Cog):
         except discord.HTTPException:
             pass
 
+        # we can only ping an unmentionable role with Mention Everyone
+        needs_toggle = (
+            not role.mentionable
+            and not ctx.channel.permissions_for(ctx.me).mention_everyone
+        )
+
         # make the role mentionable
-        await role.edit(mentionable=True)
+        if needs_toggle:
+            await role.edit(mentionable=True)
 
         # then send the message..
         mentions = discord.AllowedMentions(roles=[role])
         await ctx.send(f"{role.mention}: {content}"[:2000], allowed_mentions=mentions)
 
         # then make the role unmentionable
-        await role.edit(mentionable=False)
+        if needs_toggle:
+            await role.edit(mentionable=False)
 
 
 def setup(bot):
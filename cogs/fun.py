@@ -7,23 +7,30 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from __future__ import annotations
 
 import asyncio
+import enum
 import io
+import logging
 import math
+import multiprocessing
 import random
 import re
 import textwrap
 import time
-from functools import partial
-from string import ascii_lowercase
+from array import array
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from textwrap import fill
-from typing import TYPE_CHECKING, List, Optional
+from typing import TYPE_CHECKING, DefaultDict, Iterator, List, Optional, Tuple
 
+import aiohttp
 import discord
 import googletrans
+import orjson
 from discord.ext import commands, tasks
 from PIL import Image, ImageDraw, ImageFilter, ImageFont
 
-from utils import checks, db, lang
+from utils import cache, checks, db, lang
 from utils.context import Context
 from utils.converters import RedditMediaURL
 from utils.formats import plural
@@ -31,14 +38,57 @@ from utils.formats import plural
 if TYPE_CHECKING:
     from bot import Akane
 
+log = logging.getLogger(__name__)
+
 ABT_REG = re.compile(r"~([a-zA-Z]+)~")
 MESSAGE_LINK_RE = re.compile(
     r"^(?:https?://)(?:(?:canary|ptb)\.)?discord(?:app)?\.com/channels/(?P<guild>\d{16,20})/(?P<channel>\d{16,20})/(?P<message>\d{16,20})/?$"
 )
 
+AB_TABLE = str.maketrans(
+    {
+        **lang.ab_charmap,
+        **{key.upper(): value.upper() for key, value in lang.ab_charmap.items()},
+    }
+)
+AB_INVERSE = {value: key for key, value in lang.ab_charmap.items()}
+
 MENTION_CHANNEL_ID = 722930330897743894
 DM_CHANNEL_ID = 722930296756109322
 SPOILER_EMOJI_ID = 738038828928860269
+NOTIFICATION_TITLES = {
+    MENTION_CHANNEL_ID: "Akane was mentioned!",
+    DM_CHANNEL_ID: "Akane was DM'd.",
+}
+TRANSLATE_URL = "https://translate.googleapis.com/translate_a/single"
+
+STATISTICS_MESSAGES = """
+```prolog
+Message Deletes      : {message_deletes:,}
+Bulk Message Deletes : {bulk_message_deletes:,}
+Message Edits        : {message_edits:,}
+```
+"""
+STATISTICS_GUILDS = """
+```prolog
+Banned Members       : {bans:,}
+Unbanned Members     : {unbans:,}
+Channel Creation     : {channel_creates:,}
+Channel Deletion     : {channel_deletes:,}
+```
+"""
+
+
+class Stat(enum.IntEnum):
+    # indices into Fun._counts, named after the statistics columns
+    message_deletes = 0
+    bulk_message_deletes = 1
+    message_edits = 2
+    bans = 3
+    unbans = 4
+    channel_deletes = 5
+    channel_creates = 6
+    command_count = 7
 
 
 class StatisticsTable(db.Table, table_name="statistics"):
@@ -107,22 +157,61 @@ class SpoilerCache:
         return embed
 
 
+@lru_cache(maxsize=None)
+def _typeracer_font() -> ImageFont.FreeTypeFont:
+    # loaded once in each worker process rather than pickled across
+    return ImageFont.truetype("static/W6.ttc", 60)
+
+
+def _draw_words(text: str) -> bytes:
+    """Renders the typeracer prompt. Runs in the cog's process pool."""
+    text = fill(text, 25)
+    font = _typeracer_font()
+    padding = 50
+
+    w, h = font.getsize_multiline(text)
+    foreground = Image.new("RGBA", (w + padding, h + padding), color=0)
+    ImageDraw.Draw(foreground).multiline_text(
+        (padding / 2, padding / 2), text=text, fill="white", font=font
+    )
+
+    # the shadow is the same glyphs in a flat dark colour, so only its alpha
+    # needs blurring, one band instead of four
+    shadow = foreground.getchannel("A").filter(ImageFilter.GaussianBlur(radius=7))
+    background = Image.new("RGBA", foreground.size, color=(47, 49, 54, 0))
+    background.putalpha(shadow)
+    image = Image.alpha_composite(background, foreground)
+    buf = io.BytesIO()
+    # zlib's default level dominates the save time for an image this size
+    image.save(buf, "png", compress_level=1)
+    # BytesIO can't be pickled back to the parent, the raw bytes can
+    return buf.getvalue()
+
+
 class Fun(commands.Cog):
     """Some fun stuff, not fleshed out yet."""
 
     def __init__(self, bot: Akane):
         self.bot = bot
-        self.lock = asyncio.Lock()
-        self.message_deletes = 0
-        self.bulk_message_deletes = 0
-        self.message_edits = 0
-        self.bans = 0
-        self.unbans = 0
-        self.channel_deletes = 0
-        self.channel_creates = 0
-        self.command_count = 0
+        self._counts = array("q", [0] * len(Stat))
         self.bulk_update.start()
-        self.translator = googletrans.Translator()
+        self._notify_queue: asyncio.Queue[Tuple[int, discord.Message]] = (
+            asyncio.Queue()
+        )
+        self.flush_notifications.start()
+        with open("static/words.txt", "r") as fp:
+            self._words = tuple(
+                word.lower() for line in fp if (word := line.strip())
+            )
+        # the render is CPU bound, so keep it off the GIL and the default executor;
+        # forkserver because forking would copy the running loop and gateway threads
+        self._draw_pool = ProcessPoolExecutor(
+            max_workers=2, mp_context=multiprocessing.get_context("forkserver")
+        )
+
+    def cog_unload(self):
+        self.flush_notifications.cancel()
+        self._draw_pool.shutdown(wait=False)
 
     # @commands.Cog.listener("on_message")
     async def quote(self, message: discord.Message) -> None:
@@ -134,12 +223,8 @@ class Fun(commands.Cog):
         if perms.send_messages is False or perms.embed_links is False:
             return
 
-        if not (
-            match := re.search(
-                MESSAGE_LINK_RE,
-                message.content,
-            )
-        ):
+        # the pattern is anchored, so match is enough
+        if not (match := MESSAGE_LINK_RE.match(message.content)):
             return
 
         data = match.groupdict()
@@ -168,14 +253,16 @@ class Fun(commands.Cog):
             name=quote_message.author.name, icon_url=quote_message.author.avatar_url
         )
         embed.description = quote_message.content or "No message content."
-        fmt = "This message had:\n"
+        extras = []
         if quote_message.embeds:
-            fmt += "one or more Embeds\n"
+            extras.append("one or more Embeds")
         if quote_message.attachments:
-            fmt += "one or more Attachments\n"
+            extras.append("one or more Attachments")
 
-        if len(fmt.split("\n")) >= 3:
-            embed.add_field(name="Also...", value=fmt)
+        if extras:
+            embed.add_field(
+                name="Also...", value="This message had:\n" + "\n".join(extras)
+            )
 
         embed.timestamp = quote_message.created_at
 
@@ -184,47 +271,58 @@ class Fun(commands.Cog):
     @commands.group(invoke_without_command=True, skip_extra=False)
     async def abt(self, ctx, *, content: commands.clean_content):
         """I love this language."""
-        keep = re.findall(ABT_REG, content)
-
-        def trans(m):
-            get = m.group(0)
-            if get.isupper():
-                return lang.ab_charmap[get.lower()].upper()
-            return lang.ab_charmap[get]
-
-        repl = re.sub("[a-zA-Z]", trans, content)
-        fin = re.sub(ABT_REG, lambda m: keep.pop(0), repl)
-        await ctx.send(fin)
+        # split gives [text, kept, text, kept, ...], kept words lose their tildes
+        pieces = ABT_REG.split(content)
+        pieces[::2] = [piece.translate(AB_TABLE) for piece in pieces[::2]]
+        await ctx.send("".join(pieces))
 
     @abt.command(name="r", aliases=["reverse"])
     async def abt_reverse(self, ctx, *, tr_input: str):
         """Uno reverse."""
-        new_str = ""
+        parts = []
         br = True
         for char in tr_input:
             if char == "~":
                 br = not br
-            if br and (char.lower() in ascii_lowercase):
-                new_str += [
-                    key for key, val in lang.ab_charmap.items() if val == char.lower()
-                ][0]
-            else:
-                new_str += char
+            # the inverse map covers exactly a-z, so it doubles as the membership test
+            parts.append(AB_INVERSE.get(char.lower(), char) if br else char)
+        new_str = "".join(parts)
         await ctx.send(new_str.replace("~", "").capitalize())
 
+    @cache.cache(maxsize=1024, strategy=cache.Strategy.lru)
+    async def _translate(self, message: str) -> googletrans.models.Translated:
+        # the same endpoint googletrans scrapes, but on our own event loop
+        # the text goes in the form body, url encoding can blow it past url limits
+        params = {"client": "gtx", "sl": "auto", "tl": "en", "dt": "t"}
+        async with self.bot.session.post(
+            TRANSLATE_URL, params=params, data={"q": message}
+        ) as resp:
+            resp.raise_for_status()
+            data = orjson.loads(await resp.read())
+
+        if not isinstance(data, list) or len(data) < 3 or not data[0]:
+            raise ValueError("Unexpected response from Google Translate.")
+
+        text = "".join(part[0] for part in data[0] if part and part[0])
+        return googletrans.models.Translated(
+            src=data[2], dest="en", origin=message, text=text, pronunciation=None
+        )
+
     @commands.command()
     async def translate(self, ctx, *, message: commands.clean_content):
         """Translates a message to English using Google translate."""
-        ret = await self.bot.loop.run_in_executor(
-            None, self.translator.translate, message
-        )
+        try:
+            ret = await self._translate(message)
+        except (aiohttp.ClientError, ValueError):
+            # neither is cached, so a retry goes back out to Google
+            return await ctx.send("Could not translate that, try again later.")
 
         embed = discord.Embed(title="Translated", colour=0x000001)
         src = googletrans.LANGUAGES.get(ret.src, "(auto-detected)").title()
         dest = googletrans.LANGUAGES.get(ret.dest, "Unknown").title()
         source_text = ret.origin if len(ret.origin) < 1000 else "Too long to display."
         if len(ret.text) > 1000:
-            lines = "\n".join(textwrap.wrap(ret.text))
+            lines = textwrap.fill(ret.text)
             url = await self.bot.mb_client.post(lines, syntax="text")
             dest_text = f"[Here!]({url})"
         else:
@@ -235,70 +333,110 @@ class Fun(commands.Cog):
 
     @commands.Cog.listener()
     async def on_raw_message_delete(self, payload):
-        async with self.lock:
-            self.message_deletes += 1
+        self._counts[Stat.message_deletes] += 1
 
     @commands.Cog.listener()
     async def on_message(self, message):
+        # the vast majority of messages are guild chatter that doesn't ping us
+        mentioned = self.bot.user in message.mentions
+        if not mentioned and message.guild:
+            return
         if message.author.id in (self.bot.user.id, self.bot.owner_id):
             return
         if self.bot.blacklist.get(message.author.id):
             # Blocked.
             return
 
-        if self.bot.user in message.mentions:
-            channel = self.bot.get_channel(MENTION_CHANNEL_ID)
-            embed = discord.Embed(title="Akane was mentioned!")
+        if mentioned:
+            self._notify_queue.put_nowait((MENTION_CHANNEL_ID, message))
+        else:
+            self._notify_queue.put_nowait((DM_CHANNEL_ID, message))
+
+    def _notification_embeds(
+        self, channel_id: int, messages: List[discord.Message]
+    ) -> Iterator[discord.Embed]:
+        title = NOTIFICATION_TITLES[channel_id]
+        jump = channel_id == MENTION_CHANNEL_ID
+
+        if len(messages) == 1:
+            message = messages[0]
+            embed = discord.Embed(title=title)
             embed.set_author(
                 name=message.author.name, icon_url=message.author.avatar_url
             )
-            embed.description = f"{message.content}\n\n[Jump!]({message.jump_url})"
+            embed.description = message.content
+            if jump:
+                embed.description += f"\n\n[Jump!]({message.jump_url})"
             embed.timestamp = message.created_at
-            await channel.send(embed=embed)
-        elif not message.guild:
-            channel = self.bot.get_channel(DM_CHANNEL_ID)
-            embed = discord.Embed(title="Akane was DM'd.")
-            embed.set_author(
-                name=message.author.name, icon_url=message.author.avatar_url
-            )
-            embed.description = f"{message.content}"
+            yield embed
+            return
+
+        # a burst goes out as one field per message, split at the embed limits
+        embed = discord.Embed(title=title)
+        for message in messages:
+            name = str(message.author)
+            value = message.content or "No message content."
+            if len(value) > 900:
+                value = value[:900] + "\N{HORIZONTAL ELLIPSIS}"
+            if jump:
+                value += f"\n\n[Jump!]({message.jump_url})"
+
+            if len(embed.fields) == 25 or len(embed) + len(name) + len(value) > 6000:
+                yield embed
+                embed = discord.Embed(title=title)
+            embed.add_field(name=name, value=value, inline=False)
             embed.timestamp = message.created_at
-            await channel.send(embed=embed)
+        yield embed
+
+    @tasks.loop(seconds=2)
+    async def flush_notifications(self):
+        pending: DefaultDict[int, List[discord.Message]] = defaultdict(list)
+        while not self._notify_queue.empty():
+            channel_id, message = self._notify_queue.get_nowait()
+            pending[channel_id].append(message)
+
+        for channel_id, messages in pending.items():
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                continue
+            for embed in self._notification_embeds(channel_id, messages):
+                # an HTTPException would otherwise end the loop for good
+                try:
+                    await channel.send(embed=embed)
+                except discord.HTTPException:
+                    log.exception("Failed to send notification to %s", channel_id)
+
+    @flush_notifications.before_loop
+    async def before_flush_notifications(self):
+        await self.bot.wait_until_ready()
 
     @commands.Cog.listener()
     async def on_raw_bulk_message_delete(self, payload):
-        async with self.lock:
-            self.bulk_message_deletes += 1
+        self._counts[Stat.bulk_message_deletes] += 1
 
     @commands.Cog.listener()
     async def on_raw_message_edit(self, payload):
-        async with self.lock:
-            self.message_edits += 1
+        self._counts[Stat.message_edits] += 1
 
     @commands.Cog.listener()
     async def on_member_ban(self, guild, user):
-        async with self.lock:
-            self.bans += 1
+        self._counts[Stat.bans] += 1
 
     @commands.Cog.listener()
     async def on_member_unban(self, guild, user):
-        async with self.lock:
-            self.unbans += 1
+        self._counts[Stat.unbans] += 1
 
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel):
-        async with self.lock:
-            self.channel_deletes += 1
+        self._counts[Stat.channel_deletes] += 1
 
     @commands.Cog.listener()
     async def on_guild_channel_create(self, channel):
-        async with self.lock:
-            self.channel_creates += 1
+        self._counts[Stat.channel_creates] += 1
 
     @commands.Cog.listener()
     async def on_command(self, ctx):
-        async with self.lock:
-            self.command_count += 1
+        self._counts[Stat.command_count] += 1
 
     @tasks.loop(minutes=10)
     async def bulk_update(self):
@@ -314,26 +452,19 @@ class Fun(commands.Cog):
                     command_count = command_count + $8
                     WHERE id = 1;
                 """
-        async with self.lock:
-            await self.bot.pool.execute(
-                query,
-                self.message_deletes,
-                self.bulk_message_deletes,
-                self.message_edits,
-                self.bans,
-                self.unbans,
-                self.channel_deletes,
-                self.channel_creates,
-                self.command_count,
-            )
-            self.message_deletes = 0
-            self.bulk_message_deletes = 0
-            self.message_edits = 0
-            self.bans = 0
-            self.unbans = 0
-            self.channel_deletes = 0
-            self.channel_creates = 0
-            self.command_count = 0
+        # rebinding the attribute is the whole swap, nothing can interleave with it
+        counts, self._counts = self._counts, array("q", [0] * len(Stat))
+        if not any(counts):
+            return
+
+        try:
+            await self.bot.pool.execute(query, *counts)
+        except Exception:
+            # put the snapshot back so the next run picks it up, and don't raise:
+            # anything but a connection error would stop the loop for good
+            for index, count in enumerate(counts):
+                self._counts[index] += count
+            log.exception("Failed to flush statistics, retrying next run")
 
     @commands.command()
     @commands.cooldown(1, 60, commands.BucketType.guild)
@@ -342,41 +473,40 @@ class Fun(commands.Cog):
         query = "SELECT * FROM statistics LIMIT 1;"
         stat_record = await self.bot.pool.fetchrow(query)
 
-        message_deletes = stat_record["message_deletes"] + self.message_deletes
-        bulk_message_deletes = (
-            stat_record["bulk_message_deletes"] + self.bulk_message_deletes
-        )
-        message_edits = stat_record["message_edits"] + self.message_edits
-        bans = stat_record["bans"] + self.bans
-        unbans = stat_record["unbans"] + self.unbans
-        channel_deletes = stat_record["channel_deletes"] + self.channel_deletes
-        channel_creates = stat_record["channel_creates"] + self.channel_creates
-        command_count = stat_record["command_count"] + self.command_count
+        # nothing awaits between these reads, so the unflushed counts are consistent
+        (
+            message_deletes,
+            bulk_message_deletes,
+            message_edits,
+            bans,
+            unbans,
+            channel_deletes,
+            channel_creates,
+            command_count,
+        ) = (stat_record[stat.name] + self._counts[stat] for stat in Stat)
 
         embed = discord.Embed(title="Akane Stats")
         embed.description = (
             "Hello! Since 6th of July, 2020, I have witnessed the following events."
         )
-        message_str = f"""
-        ```prolog
-        Message Deletes      : {message_deletes:,}
-        Bulk Message Deletes : {bulk_message_deletes:,}
-        Message Edits        : {message_edits:,}
-        ```
-        """
-        guild_str = f"""
-        ```prolog
-        Banned Members       : {bans:,}
-        Unbanned Members     : {unbans:,}
-        Channel Creation     : {channel_creates:,}
-        Channel Deletion     : {channel_deletes:,}
-        ```
-        """
         embed.add_field(
-            name="**Messages**", value=textwrap.dedent(message_str), inline=False
+            name="**Messages**",
+            value=STATISTICS_MESSAGES.format(
+                message_deletes=message_deletes,
+                bulk_message_deletes=bulk_message_deletes,
+                message_edits=message_edits,
+            ),
+            inline=False,
         )
         embed.add_field(
-            name="**Guilds**", value=textwrap.dedent(guild_str), inline=False
+            name="**Guilds**",
+            value=STATISTICS_GUILDS.format(
+                bans=bans,
+                unbans=unbans,
+                channel_creates=channel_creates,
+                channel_deletes=channel_deletes,
+            ),
+            inline=False,
         )
         embed.set_footer(text=f"I have also run {command_count:,} commands!")
 
@@ -397,40 +527,14 @@ class Fun(commands.Cog):
             if int(resp.headers["Content-Length"]) >= filesize:
                 return await ctx.send("Video is too big to be uploaded.")
 
-            data = await resp.read()
-            await ctx.send(
-                file=discord.File(io.BytesIO(data), filename=reddit.filename)
-            )
+            buf = io.BytesIO()
+            async for chunk in resp.content.iter_chunked(65536):
+                buf.write(chunk)
+            buf.seek(0)
+            await ctx.send(file=discord.File(buf, filename=reddit.filename))
 
-    def _draw_words(self, text: str) -> io.BytesIO:
-        """."""
-        text = fill(text, 25)
-        font = ImageFont.truetype("static/W6.ttc", 60)
-        padding = 50
-
-        images = [Image.new("RGBA", (1, 1), color=0) for _ in range(2)]
-        for index, (image, colour) in enumerate(zip(images, ((47, 49, 54), "white"))):
-            draw = ImageDraw.Draw(image)
-            w, h = draw.multiline_textsize(text, font=font)
-            images[index] = image = image.resize((w + padding, h + padding))
-            draw = ImageDraw.Draw(image)
-            draw.multiline_text(
-                (padding / 2, padding / 2), text=text, fill=colour, font=font
-            )
-        background, foreground = images
-
-        background = background.filter(ImageFilter.GaussianBlur(radius=7))
-        background.paste(foreground, (0, 0), foreground)
-        buf = io.BytesIO()
-        background.save(buf, "png")
-        buf.seek(0)
-        return buf
-
-    def random_words(self, amount: int) -> str:
-        with open("static/words.txt", "r") as fp:
-            words = fp.readlines()
-
-        return random.sample(words, amount)
+    def random_words(self, amount: int) -> List[str]:
+        return random.sample(self._words, amount)
 
     @commands.command()
     @commands.cooldown(1, 10, commands.BucketType.channel)
@@ -448,12 +552,12 @@ class Fun(commands.Cog):
         await ctx.send("Type-racing begins in 5 seconds.")
         await asyncio.sleep(5)
 
-        words = self.random_words(amount)
-        randomized_words = (" ".join(words)).replace("\n", "").strip().lower()
+        randomized_words = " ".join(self.random_words(amount))
 
-        func = partial(self._draw_words, randomized_words)
-        image = await ctx.bot.loop.run_in_executor(None, func)
-        file = discord.File(fp=image, filename="typerace.png")
+        image = await ctx.bot.loop.run_in_executor(
+            self._draw_pool, _draw_words, randomized_words
+        )
+        file = discord.File(fp=io.BytesIO(image), filename="typerace.png")
         await ctx.send(file=file)
 
         winners = dict()
@@ -461,14 +565,18 @@ class Fun(commands.Cog):
 
         start = time.time()
 
+        target_length = len(randomized_words)
+
         def check(message: discord.Message) -> bool:
+            content = message.content
             if (
                 message.channel == ctx.channel
+                and len(content) == target_length
                 and not message.author.bot
-                and message.content.lower() == randomized_words
-                and message.author not in winners
+                and message.author.id not in winners
+                and content.lower() == randomized_words
             ):
-                winners[message.author] = time.time() - start
+                winners[message.author.id] = (message.author, time.time() - start)
                 is_ended.set()
                 ctx.bot.loop.create_task(message.add_reaction(ctx.bot.emoji[True]))
 
@@ -486,7 +594,7 @@ class Fun(commands.Cog):
             )
             embed.description = "\n".join(
                 f"{idx}: {person.mention} - {time:.4f} seconds for {len(randomized_words) / time * 12:.2f}WPM"
-                for idx, (person, time) in enumerate(winners.items(), start=1)
+                for idx, (person, time) in enumerate(winners.values(), start=1)
             )
 
             await ctx.send(embed=embed)
@@ -497,11 +605,20 @@ class Fun(commands.Cog):
         self, member: discord.Member, channels: List[discord.VoiceChannel]
     ) -> Optional[discord.VoiceChannel]:
         """ """
-        random.shuffle(channels)
-        for channel in channels:
-            if channel.permissions_for(member).connect:
-                return channel
-        return None
+        allowed = [c for c in channels if c.permissions_for(member).connect]
+        return random.choice(allowed) if allowed else None
+
+    async def _move_members(
+        self, moves: List[Tuple[discord.Member, Optional[discord.VoiceChannel]]]
+    ) -> None:
+        # a handful in flight at once keeps us clear of the route's ratelimit
+        sem = asyncio.Semaphore(5)
+
+        async def move(member, channel):
+            async with sem:
+                await member.move_to(channel)
+
+        await asyncio.gather(*(move(m, c) for m, c in moves), return_exceptions=True)
 
     @commands.command(hidden=True, name="scatter", aliases=["scattertheweak"])
     @checks.has_guild_permissions(administrator=True)
@@ -511,11 +628,14 @@ class Fun(commands.Cog):
             return
 
         members = ctx.author.voice.channel.members
+        channels = ctx.guild.voice_channels
+        moves = []
         for member in members:
-            target = self.safe_chan(member, ctx.guild.voice_channels)
+            target = self.safe_chan(member, channels)
             if target is None:
                 continue
-            await member.move_to(target)
+            moves.append((member, target))
+        await self._move_members(moves)
 
     @commands.command(hidden=True, name="snap")
     @checks.has_guild_permissions(administrator=True)
@@ -528,8 +648,7 @@ class Fun(commands.Cog):
         upper = math.ceil(len(members) / 2)
         choices = random.choices(members, k=upper)
 
-        for m in choices:
-            await m.move_to(None)
+        await self._move_members([(m, None) for m in choices])
 
 
 def setup(bot: Akane):
@@ -4,6 +4,8 @@ License, v. 2.0. If a copy of the MPL was not distributed with this
 file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
+import asyncio
+import copy
 from typing import Any, List, Mapping, Sequence, Union
 
 import discord
@@ -15,9 +17,13 @@ from utils.paginator import RoboPages
 class HelpSource(menus.ListPageSource):
     def __init__(self, data: Sequence[Any]) -> None:
         self.data = data
+        # kept apart so re-rendering a page doesn't stack the prefix
+        self.titles = [embed.title for embed in data]
         super().__init__(data, per_page=1)
 
-    async def format_page(self, menu: menus.Menu, page: int) -> discord.Embed:
+    async def format_page(self, menu: menus.Menu, page: discord.Embed) -> discord.Embed:
+        index = menu.current_page
+        page.title = f"Page {index + 1}/{self.get_max_pages()}: {self.titles[index]}"
         return page
 
 
@@ -30,19 +36,20 @@ class PaginatedHelpCommand(commands.HelpCommand):
     async def recursive_command_format(
         self, command: commands.Command, *, indent=1, subc=0
     ):
-        yield (
-            "" if indent == 1 else "├" if subc != 0 else "└"
-        ) + f"`{command.qualified_name}`: {command.short_doc}"
-        if isinstance(command, commands.Group):
-            last = len(command.commands) - 1
-            for _, command in enumerate(
-                await self.filter_commands(command.commands, sort=True)
-            ):
-                async for result in self.recursive_command_format(
-                    command, indent=indent + 1, subc=last
-                ):
-                    yield result
-                last -= 1
+        # depth first with an explicit stack, children pushed in reverse
+        stack = [(command, indent, subc)]
+        while stack:
+            command, indent, subc = stack.pop()
+            yield (
+                "" if indent == 1 else "├" if subc != 0 else "└"
+            ) + f"`{command.qualified_name}`: {command.short_doc}"
+            if isinstance(command, commands.Group):
+                last = len(command.commands) - 1
+                children = await self.filter_commands(command.commands, sort=True)
+                stack.extend(
+                    (child, indent + 1, last - index)
+                    for index, child in reversed(list(enumerate(children)))
+                )
 
     async def format_commands(
         self,
@@ -56,14 +63,18 @@ class PaginatedHelpCommand(commands.HelpCommand):
 
         pg = commands.Paginator(max_size=2000, prefix="", suffix="")
 
-        for command in cmds:
-            try:
-                await command.can_run(self.context)
-            except (discord.Forbidden, commands.CheckFailure, commands.CommandError):
+        # can_run swaps ctx.command while it awaits, so each check gets its own copy
+        results = await asyncio.gather(
+            *(command.can_run(copy.copy(self.context)) for command in cmds),
+            return_exceptions=True,
+        )
+        for command, result in zip(cmds, results):
+            if isinstance(result, (discord.Forbidden, commands.CommandError)):
                 continue
-            else:
-                async for line in self.recursive_command_format(command):
-                    pg.add_line(line)
+            if isinstance(result, BaseException):
+                raise result
+            async for line in self.recursive_command_format(command):
+                pg.add_line(line)
 
         for desc in pg.pages:
             embed = discord.Embed(
@@ -88,10 +99,6 @@ class PaginatedHelpCommand(commands.HelpCommand):
             cmds = await self.filter_commands(cmds, sort=True)
             await self.format_commands(cog, cmds, pages=pages)
 
-        total = len(pages)
-        for i, embed in enumerate(pages, start=1):
-            embed.title = f"Page {i}/{total}: {embed.title}"
-
         pg = RoboPages(HelpSource(pages))
         await pg.start(self.context)
 
@@ -102,10 +109,6 @@ class PaginatedHelpCommand(commands.HelpCommand):
             cog, await self.filter_commands(cog.get_commands(), sort=True), pages=pages
         )
 
-        total = len(pages)
-        for i, embed in enumerate(pages, start=1):
-            embed.title = f"Page {i}/{total}: {embed.title}"
-
         pg = RoboPages(HelpSource(pages))
         await pg.start(self.context)
 
@@ -126,6 +126,7 @@ class Stats(commands.Cog):
             self._data_batch.clear()
 
     def cog_unload(self):
+        self.bot.cog_ready["Stats"].clear()
         self.bulk_insert_loop.stop()
         self.gateway_worker.cancel()
 
@@ -1264,6 +1265,7 @@ def setup(bot):
 
     cog = Stats(bot)
     bot.add_cog(cog)
+    bot.cog_ready["Stats"].set()
     bot._stats_cog_gateway_handler = handler = GatewayHandler(cog)
     logging.getLogger().addHandler(handler)
     commands.Bot.on_error = on_error
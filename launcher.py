@@ -11,6 +11,7 @@ import logging
 import sys
 import traceback
 
+import asyncpg
 import click
 
 import config
@@ -54,6 +55,8 @@ def run_bot():
                 config.postgresql,
                 command_timeout=60,
                 max_inactive_connection_lifetime=0,
+                statement_cache_size=200,
+                max_cached_statement_lifetime=0,
             )
         )
     except Exception:
@@ -127,6 +130,61 @@ def init(cogs, quiet):
                 )
 
 
+async def sync_tables(quiet):
+    try:
+        pool = await Table.create_pool(config.postgresql)
+    except Exception:
+        click.echo(
+            f"Could not create PostgreSQL connection pool.\n{traceback.format_exc()}",
+            err=True,
+        )
+        return
+
+    async with pool.acquire() as con:
+        for table in Table.all_tables():
+            # every statement is IF NOT EXISTS, so this only fills in what's missing
+            sql = table.create_table(exists_ok=True)
+            if not quiet:
+                click.echo(sql)
+            try:
+                async with con.transaction():
+                    await con.execute(sql)
+            except asyncpg.UniqueViolationError as e:
+                click.echo(
+                    f"Could not add a unique index to {table.__tablename__}, "
+                    f"remove the duplicate rows first: {e.detail}",
+                    err=True,
+                )
+            else:
+                click.echo(f"[{table.__module__}] Synced {table.__tablename__}.")
+
+
+@db.command(short_help="adds missing tables and indexes to existing databases")
+@click.argument("cogs", nargs=-1, metavar="[cogs]")
+@click.option("-q", "--quiet", help="less verbose output", is_flag=True)
+def sync(cogs, quiet):
+    """Re-runs each table's CREATE statements against an existing database.
+
+    Migrations only track columns, so indexes added to create_table later
+    (such as feeds_uniq_idx) are applied with this instead.
+    """
+
+    if not cogs:
+        cogs = EXTENSIONS
+    else:
+        cogs = [f"cogs.{e}" if not e.startswith("cogs.") else e for e in cogs]
+
+    for ext in cogs:
+        try:
+            importlib.import_module(ext)
+        except Exception:
+            click.echo(f"Could not load {ext}.\n{traceback.format_exc()}", err=False)
+            continue
+
+    run = asyncio.get_event_loop().run_until_complete
+    run(sync_tables(quiet))
+
+
 @db.command(short_help="migrates the databases")
 @click.argument("cog", nargs=1, metavar="[cog]")
 @click.option("-q", "--quiet", help="less verbose output", is_flag=True)
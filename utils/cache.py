@@ -50,7 +50,8 @@ class ExpiringCache(dict):
 
     def __getitem__(self, key: Any) -> Any:
         self.__verify_cache_integrity()
-        return super().__getitem__(key)
+        value, _ = super().__getitem__(key)
+        return value
 
     def __setitem__(self, key: Any, value: Any) -> None:
         super().__setitem__(key, (value, time.monotonic()))
@@ -43,6 +43,9 @@ class Context(commands.Context):
         super().__init__(**kwargs)
         self.pool = self.bot.pool
         self._db: Optional[asyncpg.Connection] = None
+        # memoised by the Config cog's global checks
+        self._is_owner: Optional[bool] = None
+        self._manage_guild: Optional[bool] = None
 
     def __repr__(self) -> str:
         # we need this for our cache key strategy